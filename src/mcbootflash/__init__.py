@@ -11,13 +11,16 @@ from .flash import (
     checksum,
     erase_flash,
     get_boot_attrs,
+    get_local_checksum,
+    get_remote_checksum,
     read_flash,
     reset,
     self_verify,
+    write_and_checksum,
     write_flash,
 )
 from .protocol import BootAttrs, Chunk, Command
-from .util import chunked, readback
+from .util import chunked, readback, stale_pages
 
 __all__ = [
     "BadAddress",
@@ -32,10 +35,14 @@ __all__ = [
     "chunked",
     "erase_flash",
     "get_boot_attrs",
+    "get_local_checksum",
+    "get_remote_checksum",
     "read_flash",
     "readback",
     "reset",
     "self_verify",
+    "stale_pages",
+    "write_and_checksum",
     "write_flash",
 ]
 
@@ -13,13 +13,18 @@ from pathlib import Path
 from typing import TYPE_CHECKING, Final, TextIO
 
 import bincopy  # type: ignore[import-untyped]
-from serial import Serial, SerialException  # type: ignore[import-untyped]
+from serial import (  # type: ignore[import-untyped]
+    Serial,
+    SerialException,
+    SerialTimeoutException,
+)
 
 from mcbootflash import (
     BadAddress,
     BootAttrs,
     BootloaderError,
     Chunk,
+    UnsupportedCommand,
     VerifyFail,
     __version__,
     checksum,
@@ -28,6 +33,8 @@ from mcbootflash import (
     get_boot_attrs,
     reset,
     self_verify,
+    stale_pages,
+    write_and_checksum,
     write_flash,
 )
 
@@ -50,6 +57,11 @@ else:
 
 logger = logging.getLogger(__name__)
 APPNAME: Final[str] = "mcbootflash"
+# Size of the OS serial driver buffers requested on Windows, where pyserial defaults
+# to 4 KiB.
+SERIAL_BUFFER_SIZE: Final[int] = 64 * 1024
+# Minimum number of seconds between progressbar redraws.
+PROGRESS_INTERVAL: Final[float] = 0.1
 
 
 class HandledException(Exception):
@@ -76,6 +88,12 @@ def get_parser() -> argparse.ArgumentParser:
             baudrate: int
             timeout: float, default=1
             checksum: bool, default=False
+            chunk_size: int | None, default=None
+            erase_batch: int, default=1
+            pipeline: bool, default=False
+            reset: bool, default=False
+            skip_unchanged: bool, default=False
+            no_verify: bool, default=False
             debug: bool, default=False
             quiet: bool,  default=False
     """
@@ -117,11 +135,54 @@ def get_parser() -> argparse.ArgumentParser:
         action="store_true",
         help="verify flashed data by checksumming after write",
     )
+    parser.add_argument(
+        "--chunk-size",
+        type=positive_int,
+        help=(
+            "write at most this many bytes per packet, a multiple of the bootloader's "
+            "write size; defaults to the largest packet the bootloader accepts"
+        ),
+    )
+    parser.add_argument(
+        "--erase-batch",
+        type=positive_int,
+        default=1,
+        metavar="PAGES",
+        help=(
+            "erase up to this many adjacent flash pages per command; each command "
+            "must complete within TIMEOUT"
+        ),
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help=(
+            "experimental: with --checksum, send each checksum command without "
+            "waiting for the preceding write to complete; faster, but untested on "
+            "real devices and may overrun the bootloader's receive buffer"
+        ),
+    )
     parser.add_argument(
         "--reset",
         action="store_true",
         help="reset device after flashing is complete",
     )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help=(
+            "only erase and write flash pages whose contents differ from the HEX file, "
+            "as determined by checksum"
+        ),
+    )
+    parser.add_argument(
+        "--no-verify",
+        action="store_true",
+        help=(
+            "skip the bootloader's self verification after flashing; requires "
+            "--checksum, so that every chunk is still verified"
+        ),
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -162,6 +223,45 @@ def baudrate(baudrate: str) -> int:
     return int(baudrate)
 
 
+def positive_int(value: str) -> int:
+    """Sanitize a count which must be at least one.
+
+    Parameters
+    ----------
+    value : str
+
+    Raises
+    ------
+    argparse.ArgumentTypeError
+
+    Returns
+    -------
+    int
+    """
+    if not value.isdecimal() or int(value) < 1:
+        msg = f"invalid positive int value: '{value}'"
+        raise argparse.ArgumentTypeError(msg)
+
+    return int(value)
+
+
+def check_args(args: argparse.Namespace) -> None:
+    """Check that the combination of arguments makes sense.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+
+    Raises
+    ------
+    HandledException
+    """
+    if args.no_verify and not args.checksum:
+        # Without SELF_VERIFY, the written data would not be verified at all.
+        msg = "Error: --no-verify requires --checksum"
+        raise HandledException(msg)
+
+
 # %%#######
 # Logging #
 ###########
@@ -272,14 +372,48 @@ def connect(port: str, baudrate: int, timeout: float) -> Serial:
             port=port,
             baudrate=baudrate,
             timeout=timeout,
+            # Fail instead of blocking forever if the device stops accepting data.
+            write_timeout=timeout,
         )
         connection.reset_input_buffer()
+
+        if sys.platform == "win32":  # pragma: no cover
+            connection.set_buffer_size(
+                rx_size=SERIAL_BUFFER_SIZE,
+                tx_size=SERIAL_BUFFER_SIZE,
+            )
+
+        if sys.platform == "linux":
+            set_low_latency_mode(connection)
     except SerialException as exc:
         raise HandledException("Error: " + str(exc)) from exc
 
     return connection
 
 
+def set_low_latency_mode(connection: Serial) -> None:
+    """Try to enable low-latency mode on a Linux serial port.
+
+    Many USB-serial drivers buffer received data for up to 16 ms before passing it on.
+    Every command sent to the bootloader waits for a short response, so this delay is
+    paid once per command. Setting the ASYNC_LOW_LATENCY flag asks the driver to pass
+    on data immediately. Not all drivers support the flag, in which case the port is
+    left as is.
+
+    Parameters
+    ----------
+    connection : serial.Serial
+        Open serial connection.
+    """
+    try:
+        connection.set_low_latency_mode(True)
+    except (ValueError, OSError):
+        # This is an optimization only, it must never prevent flashing.
+        logger.debug(f"Low-latency mode not supported on {connection.name}")
+    else:
+        logger.debug(f"Enabled low-latency mode on {connection.name}")
+
+
 def handshake(connection: Serial) -> BootAttrs:
     """Make sure we're actually talking to an MCC bootloader."""
     try:
@@ -300,13 +434,48 @@ def handshake(connection: Serial) -> BootAttrs:
     return boot_attrs
 
 
-def parse_hex(hex_file: str, boot_attr: BootAttrs) -> tuple[int, Iterator[Chunk]]:
-    """Try to parse the firmware image.
+def read_hex(hex_file: str) -> bincopy.BinFile:
+    """Try to read the firmware image.
 
     Parameters
     ----------
     hex_file : str
+
+    Raises
+    ------
+    HandledException
+
+    Returns
+    -------
+    bincopy.BinFile
+    """
+    hexdata = bincopy.BinFile()
+
+    try:
+        hexdata.add_microchip_hex_file(hex_file)
+    except bincopy.Error as exc:
+        raise HandledException("Error: " + str(exc)) from exc
+
+    return hexdata
+
+
+def parse_hex(
+    hex_file: str | bincopy.BinFile,
+    boot_attr: BootAttrs,
+    pages: list[tuple[int, int]] | None = None,
+    chunk_size: int | None = None,
+) -> tuple[int, Iterator[Chunk]]:
+    """Try to parse the firmware image.
+
+    Parameters
+    ----------
+    hex_file : str | bincopy.BinFile
     boot_attr : BootAttrs
+    pages : list[tuple[int, int]] | None, default=None
+        Only include data within these flash pages.
+    chunk_size : int | None, default=None
+        Maximum number of data bytes per chunk. Must be a multiple of the bootloader's
+        write size.
 
     Raises
     ------
@@ -317,14 +486,63 @@ def parse_hex(hex_file: str, boot_attr: BootAttrs) -> tuple[int, Iterator[Chunk]
     tuple[int, Iterator[Chunk]]
 
     """
+    if chunk_size is not None and chunk_size % boot_attr.write_size:
+        msg = (
+            "Error: Chunk size must be a multiple of the bootloader's write size, "
+            f"{boot_attr.write_size} bytes"
+        )
+        raise HandledException(msg)
+
     try:
-        return chunked(hex_file, boot_attr)
+        return chunked(hex_file, boot_attr, pages, chunk_size)
     except bincopy.Error as exc:
         raise HandledException("Error: " + str(exc)) from exc
 
 
-def erase(connection: Serial, erase_range: tuple[int, int], erase_size: int) -> None:
-    """Erase flash pages one at a time.
+def compare(
+    connection: Serial,
+    hexdata: bincopy.BinFile,
+    boot_attrs: BootAttrs,
+) -> list[tuple[int, int]]:
+    """Find flash pages which must be rewritten.
+
+    Parameters
+    ----------
+    connection : serial.Serial
+        Open serial connection to device in bootloader mode.
+    hexdata : bincopy.BinFile
+    boot_attrs : BootAttrs
+
+    Raises
+    ------
+    HandledException
+        If the bootloader does not support checksumming.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        Flash pages whose contents differ from `hexdata`.
+    """
+    logger.info("Comparing flash contents...")
+
+    try:
+        pages = stale_pages(connection, hexdata, boot_attrs)
+    except UnsupportedCommand:
+        msg = "Error: --skip-unchanged requires bootloader checksum support"
+        raise HandledException(msg) from None
+
+    logger.info(f"Found {len(pages)} changed flash pages")
+    return pages
+
+
+def erase(
+    connection: Serial,
+    erase_range: tuple[int, int],
+    erase_size: int,
+    pages: list[tuple[int, int]] | None = None,
+    batch_size: int = 1,
+) -> None:
+    """Erase flash pages, one or a few at a time.
 
     Parameters
     ----------
@@ -334,18 +552,35 @@ def erase(connection: Serial, erase_range: tuple[int, int], erase_size: int) ->
         Memory range to erase.
     erase_size: int
         Size of a flash page in bytes.
+    pages: list[tuple[int, int]] | None, default=None
+        Only erase these pages within `erase_range`. By default, all pages are erased.
+    batch_size: int, default=1
+        Erase up to this many adjacent pages per command.
+
+    Raises
+    ------
+    HandledException
+        If `pages` is given and the bootloader cannot erase them individually.
     """
-    page_boundaries = range(*erase_range, erase_size)
-    total_pages = len(page_boundaries) - 1
-    time_start = time.time()
+    erase_all = pages is None
+
+    if pages is None:
+        pages = list(pairwise(range(*erase_range, erase_size)))
+
+    total_pages = len(pages)
+    erased_pages = 0
+    time_start = time.monotonic()
+    drawn_at = None
 
     try:
-        for erased_pages, page in enumerate(pairwise(page_boundaries), start=1):
-            erase_flash(connection, page, erase_size)
-            print_progress(
+        for batch in batch_pages(pages, batch_size):
+            erase_flash(connection, batch, erase_size)
+            erased_pages += (batch[1] - batch[0]) // erase_size
+            drawn_at = print_progress(
                 erased_pages * erase_size,
                 total_pages * erase_size,
-                time.time() - time_start,
+                time.monotonic() - time_start,
+                drawn_at,
             )
     except BadAddress:
         # Some bootloader versions incorrectly think addresses greater than
@@ -353,32 +588,110 @@ def erase(connection: Serial, erase_range: tuple[int, int], erase_size: int) ->
         logger.debug("Got BAD_ADDRESS during erase")
         logger.debug("This is probably a bug in the bootloader, not mcbootflash")
         logger.debug("See https://github.com/bessman/mcbootflash/issues/86")
+
+        workaround_range = (batch[0] - erase_size, erase_range[1])
+        workaround_pages = {
+            (start, start + erase_size)
+            for start in range(*workaround_range, erase_size)
+        }
+
+        if not erase_all and not workaround_pages <= set(pages):
+            # The workaround would erase pages which are not going to be rewritten.
+            msg = "Error: Bootloader cannot erase individual pages, flash all pages"
+            raise HandledException(msg) from None
+
         logger.debug("Attempting workaround by erasing all remaining pages at once")
         # Erasing many pages at once may take a while.
         tmp_timeout = connection.timeout
 
-        if connection.timeout:
+        if connection.timeout and erased_pages:
+            # Allow as much time per page as the pages erased so far have taken, with
+            # some margin.
+            per_page = (time.monotonic() - time_start) / erased_pages
+            budget = 1.5 * per_page * len(workaround_pages)
+            connection.timeout = max(connection.timeout, budget)
+        elif connection.timeout:
+            # Nothing to estimate from.
             connection.timeout *= 10
 
-        erase_flash(connection, (page[0] - erase_size, erase_range[1]), erase_size)
-        connection.timeout = tmp_timeout
+        logger.debug(f"Using timeout {connection.timeout} s for workaround")
+
+        try:
+            erase_flash(connection, workaround_range, erase_size)
+        finally:
+            connection.timeout = tmp_timeout
+
         erased_pages = total_pages
         print_progress(
             erased_pages * erase_size,
             total_pages * erase_size,
-            time.time() - time_start,
+            time.monotonic() - time_start,
+            drawn_at,
         )
 
 
+def batch_pages(
+    pages: list[tuple[int, int]],
+    batch_size: int,
+) -> list[tuple[int, int]]:
+    """Merge runs of adjacent flash pages.
+
+    Parameters
+    ----------
+    pages : list[tuple[int, int]]
+        Flash pages, in ascending order.
+    batch_size : int
+        Maximum number of pages to merge.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        Address ranges of at most `batch_size` pages each.
+    """
+    batches: list[tuple[int, int]] = []
+    pages_in_batch = 0
+
+    for start, end in pages:
+        if batches and batches[-1][1] == start and pages_in_batch < batch_size:
+            batches[-1] = (batches[-1][0], end)
+            pages_in_batch += 1
+        else:
+            batches.append((start, end))
+            pages_in_batch = 1
+
+    return batches
+
+
+def is_blank(data: bytes) -> bool:
+    """Check if data is identical to erased flash.
+
+    Parameters
+    ----------
+    data : bytes
+        Firmware data, four bytes per instruction.
+
+    Returns
+    -------
+    bool
+        True if every instruction is 0xFFFFFF. The phantom byte is ignored.
+    """
+    erased = b"\xff" * (len(data) // 4)
+    return all(data[i::4] == erased for i in range(3))
+
+
 def flash(
     connection: Serial,
     chunks: Iterator[Chunk],
     total_bytes: int,
     *,
     verify_checksum: bool,
+    pipeline: bool = False,
 ) -> None:
     """Flash application firmware.
 
+    The flash pages to write must already be erased. Chunks which contain nothing but
+    erased data are skipped, since writing them would not change the flash contents.
+
     Parameters
     ----------
     connection : serial.Serial
@@ -389,22 +702,37 @@ def flash(
         Total number of bytes to be written.
     verify_checksum : bool
         Verify integrity of written data.
+    pipeline : bool, default=False
+        Send each chunk's checksum command before its write has been acknowledged.
+        Has no effect unless `verify_checksum` is True.
     """
+    pipelined = verify_checksum and pipeline
     written_bytes = 0
-    start = time.time()
+    start = time.monotonic()
+    drawn_at = None
 
     for chunk in chunks:
-        write_flash(connection, chunk)
+        if is_blank(chunk.data):
+            logger.debug(f"Skipping blank chunk at {chunk.address:#08x}")
+        elif pipelined:
+            write_and_checksum(connection, chunk)
+        else:
+            write_flash(connection, chunk)
 
-        if verify_checksum:
-            checksum(connection, chunk)
+            if verify_checksum:
+                checksum(connection, chunk)
 
         written_bytes += len(chunk.data)
         logger.debug(
             f"{written_bytes} bytes written of {total_bytes} "
             f"({written_bytes / total_bytes * 100:.2f}%)",
         )
-        print_progress(written_bytes, total_bytes, time.time() - start)
+        drawn_at = print_progress(
+            written_bytes,
+            total_bytes,
+            time.monotonic() - start,
+            drawn_at,
+        )
 
 
 # %%############
@@ -412,9 +740,17 @@ def flash(
 ################
 
 
-def print_progress(written_bytes: int, total_bytes: int, elapsed: float) -> None:
+def print_progress(
+    written_bytes: int,
+    total_bytes: int,
+    elapsed: float,
+    drawn_at: float | None = None,
+) -> float | None:
     """Print progressbar.
 
+    The progressbar is redrawn at most once every `PROGRESS_INTERVAL` seconds, except
+    on completion which is always drawn.
+
     Parameters
     ----------
     written_bytes : int
@@ -423,13 +759,29 @@ def print_progress(written_bytes: int, total_bytes: int, elapsed: float) -> None
         Total number of bytes to write.
     elapsed : float
         Seconds since start.
+    drawn_at : float | None, default=None
+        Value of `elapsed` when this progressbar was last drawn, as returned by the
+        previous call. None if it has not been drawn yet.
+
+    Returns
+    -------
+    drawn_at : float | None
+        Value of `elapsed` when the progressbar was last drawn.
     """
     exactly_info = any(h.level == logging.INFO for h in logger.handlers)
 
     if not exactly_info:
         # Only print progressbar if at least one handler has log level INFO, not higher
         # or lower.
-        return
+        return drawn_at
+
+    # On fast links a chunk is written much faster than the terminal can be redrawn.
+    if (
+        written_bytes != total_bytes
+        and drawn_at is not None
+        and elapsed - drawn_at < PROGRESS_INTERVAL
+    ):
+        return drawn_at
 
     ratio = written_bytes / total_bytes
     percentage = f"{100 * ratio:.0f}%"
@@ -439,14 +791,10 @@ def print_progress(written_bytes: int, total_bytes: int, elapsed: float) -> None
         ratio,
         len(percentage) + len(datasize) + len(timer) + 3 * len("  "),
     )
-    print(  # noqa: T201
-        percentage,
-        datasize,
-        progress,
-        timer,
-        sep="  ",
-        end="\n" if written_bytes == total_bytes else "\r",
-    )
+    end = "\n" if written_bytes == total_bytes else "\r"
+    # Hand the whole line to stdout at once, rather than one write per field.
+    sys.stdout.write(f"{percentage}  {datasize}  {progress}  {timer}{end}")
+    return elapsed
 
 
 def get_datasize(written_bytes: float) -> str:
@@ -461,18 +809,16 @@ def get_datasize(written_bytes: float) -> str:
     -------
     str
     """
-    decimals = 0
-
-    for _prefix in ("", "Ki", "Mi"):
-        next_prefix = 1000
+    # Switch to the next prefix before the number grows to four digits.
+    next_prefix = 1000
 
-        if written_bytes < next_prefix:
-            break
+    if written_bytes < next_prefix:
+        return f"{written_bytes:.0f} B"
 
-        written_bytes /= 1024
-        decimals = 1
+    if written_bytes < next_prefix * 1024:
+        return f"{written_bytes / 1024:.1f} KiB"
 
-    return f"{written_bytes:.{decimals}f} {_prefix}B"
+    return f"{written_bytes / 1024**2:.1f} MiB"
 
 
 def get_timer(elapsed: float) -> str:
@@ -521,6 +867,55 @@ def get_bar(done_ratio: float, used_width: int) -> str:
 ########
 
 
+def run(args: argparse.Namespace) -> None:
+    """Flash the device, as instructed by the command line arguments.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed command line arguments.
+    """
+    logger.info("Connecting to bootloader...")
+    connection = connect(args.port, args.baudrate, args.timeout)
+    boot_attrs = handshake(connection)
+    # Parse the HEX file once, and reuse it for every pass.
+    hexdata = read_hex(args.hexfile)
+    pages = None
+
+    if args.skip_unchanged:
+        pages = compare(connection, hexdata, boot_attrs)
+
+    total_bytes, chunks = parse_hex(
+        hexdata,
+        boot_attrs,
+        pages,
+        args.chunk_size,
+    )
+    logger.info("Erasing program area...")
+    erase(
+        connection,
+        erase_range=boot_attrs.memory_range,
+        erase_size=boot_attrs.erase_size,
+        pages=pages,
+        batch_size=args.erase_batch,
+    )
+    logger.info(f"Flashing {args.hexfile}...")
+    flash(
+        connection,
+        chunks,
+        total_bytes=total_bytes,
+        verify_checksum=args.checksum,
+        pipeline=args.pipeline,
+    )
+
+    if not args.no_verify:
+        self_verify(connection)
+        logger.info("Self verify OK")
+
+    if args.reset:
+        reset(connection)
+
+
 def main(args: None | argparse.Namespace = None) -> int:
     """Entry point for CLI.
 
@@ -543,28 +938,8 @@ def main(args: None | argparse.Namespace = None) -> int:
 
     try:
         try:
-            logger.info("Connecting to bootloader...")
-            connection = connect(args.port, args.baudrate, args.timeout)
-            boot_attrs = handshake(connection)
-            total_bytes, chunks = parse_hex(args.hexfile, boot_attrs)
-            logger.info("Erasing program area...")
-            erase(
-                connection,
-                erase_range=boot_attrs.memory_range,
-                erase_size=boot_attrs.erase_size,
-            )
-            logger.info(f"Flashing {args.hexfile}...")
-            flash(
-                connection,
-                chunks,
-                total_bytes=total_bytes,
-                verify_checksum=args.checksum,
-            )
-            self_verify(connection)
-            logger.info("Self verify OK")
-
-            if args.reset:
-                reset(connection)
+            check_args(args)
+            run(args)
         except BaseException:
             # Log all exceptions.
             logger.debug("", exc_info=True)
@@ -579,6 +954,11 @@ def main(args: None | argparse.Namespace = None) -> int:
     except KeyboardInterrupt:
         # User said to exit early.
         return 1
+    except SerialTimeoutException:
+        # Writes time out after --timeout seconds, rather than blocking forever, if
+        # the device stops accepting data.
+        logger.error("Error: Timeout while writing to serial port")
+        return 1
     except VerifyFail:
         # This probably means mcbootflash did something wrong while flashing.
         logger.error(
@@ -1,27 +1,7 @@
 """These functions are used to communicate with the bootloader."""
 
 import logging
-import sys
-
-if sys.version_info >= (3, 12):
-    from itertools import batched
-else:  # pragma: no cover
-    from collections.abc import Iterable, Iterator
-    from itertools import islice
-    from typing import TypeVar
-
-    T = TypeVar("T")
-
-    # fmt: off
-    def batched(iterable: Iterable[T], n: int) -> Iterator[tuple[T, ...]]:  # noqa: D103
-        # Backport of `batched` to python<3.12.
-        if n < 1:
-            raise ValueError("n must be at least one")  # noqa: TRY003,EM101
-        it = iter(iterable)
-        while batch := tuple(islice(it, n)):
-            yield batch
-    # fmt: on
-
+import struct
 
 from mcbootflash.error import (
     BadAddress,
@@ -46,6 +26,24 @@ from mcbootflash.protocol import (
 
 _logger = logging.getLogger(__name__)
 _FLASH_UNLOCK_KEY = 0x00AA0055
+# IntEnum members hash like their values, so the raw command code can be used as key
+# without first constructing a CommandCode.
+_RESPONSE_TYPES: dict[int, type[ResponseBase]] = {
+    CommandCode.READ_VERSION: Version,
+    CommandCode.READ_FLASH: Response,
+    CommandCode.WRITE_FLASH: Response,
+    CommandCode.ERASE_FLASH: Response,
+    CommandCode.CALC_CHECKSUM: Checksum,
+    CommandCode.RESET_DEVICE: Response,
+    CommandCode.SELF_VERIFY: Response,
+    CommandCode.GET_MEMORY_ADDRESS_RANGE: MemoryRange,
+}
+_BOOTLOADER_EXCEPTIONS: dict[ResponseCode, type[BootloaderError]] = {
+    ResponseCode.UNSUPPORTED_COMMAND: UnsupportedCommand,
+    ResponseCode.BAD_ADDRESS: BadAddress,
+    ResponseCode.BAD_LENGTH: BadLength,
+    ResponseCode.VERIFY_FAIL: VerifyFail,
+}
 
 
 def get_boot_attrs(connection: Connection) -> BootAttrs:
@@ -192,7 +190,9 @@ def erase_flash(
         msg = "Address range is not a multiple of erase size"
         raise ValueError(msg)
 
-    _logger.debug(f"Erasing addresses {start:#08x}:{end:#08x}")
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug(f"Erasing addresses {start:#08x}:{end:#08x}")
+
     _exchange(
         connection,
         command=Command(
@@ -214,16 +214,49 @@ def write_flash(connection: Connection, chunk: Chunk) -> None:
     chunk : Chunk
         Firmware chunk to write to bootloader.
     """
-    _logger.debug(f"Writing {len(chunk.data)} bytes to {chunk.address:#08x}")
-    _exchange(
-        connection,
-        Command(
-            command=CommandCode.WRITE_FLASH,
-            data_length=len(chunk.data),
-            unlock_sequence=_FLASH_UNLOCK_KEY,
-            address=chunk.address,
-        ),
-        chunk.data,
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug(f"Writing {len(chunk.data)} bytes to {chunk.address:#08x}")
+
+    _exchange(connection, _write_flash_command(chunk), chunk.data)
+
+
+def write_and_checksum(connection: Connection, chunk: Chunk) -> None:
+    """Write data to bootloader and verify it by checksumming.
+
+    Equivalent to calling `write_flash` followed by `checksum`, except that the
+    checksum command is sent without waiting for the response to the write command.
+    This saves one serial round-trip per chunk.
+
+    Parameters
+    ----------
+    connection : Connection
+        Connection to device in bootloader mode.
+    chunk : Chunk
+        Firmware chunk to write to bootloader.
+
+    Raises
+    ------
+    BootloaderError
+        If checksums do not match.
+    """
+    write_command = _write_flash_command(chunk)
+    checksum_command = _checksum_command(chunk)
+
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug(f"Writing {len(chunk.data)} bytes to {chunk.address:#08x}")
+
+    _send(connection, write_command, chunk.data)
+    _send(connection, checksum_command)
+    _get_response(connection, write_command)
+    _compare_checksums(connection, checksum_command, chunk)
+
+
+def _write_flash_command(chunk: Chunk) -> Command:
+    return Command(
+        command=CommandCode.WRITE_FLASH,
+        data_length=len(chunk.data),
+        unlock_sequence=_FLASH_UNLOCK_KEY,
+        address=chunk.address,
     )
 
 
@@ -262,31 +295,67 @@ def checksum(
     BootloaderError
         If checksums do not match.
     """
-    checksum1 = _get_local_checksum(chunk.data)
+    command = _checksum_command(chunk)
+    _send(connection, command)
+    _compare_checksums(connection, command, chunk)
+
+
+def _checksum_command(chunk: Chunk) -> Command:
+    return Command(
+        command=CommandCode.CALC_CHECKSUM,
+        data_length=len(chunk.data),
+        address=chunk.address,
+    )
+
+
+def _compare_checksums(connection: Connection, command: Command, chunk: Chunk) -> None:
+    # Read the response to an already sent CALC_CHECKSUM command and compare it to the
+    # checksum of the chunk.
+    checksum1 = get_local_checksum(chunk.data)
 
     try:
-        checksum2 = _get_remote_checksum(connection, chunk.address, len(chunk.data))
+        checksum_response = _get_response(connection, command)
     except BadAddress:
         _logger.warning("Got BAD_ADDRESS while checksumming, continuing anyway")
         _logger.warning("This is probably a bug in the bootloader, not in mcbootflash")
         _logger.warning("See https://github.com/bessman/mcbootflash/issues/54")
         return
 
+    assert isinstance(checksum_response, Checksum)
+    checksum2 = checksum_response.checksum
+
     if checksum1 != checksum2:
         _logger.debug(f"Checksum mismatch: {checksum1} != {checksum2}")
         _logger.debug("unlock_sequence field may be incorrect")
         msg = "Checksum mismatch"
         raise BootloaderError(msg)
 
-    _logger.debug(f"Checksum OK: {checksum1}")
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug(f"Checksum OK: {checksum1}")
+
+
+def get_remote_checksum(connection: Connection, address: int, size: int) -> int:
+    """Calculate checksum of flash memory onboard device.
 
+    Parameters
+    ----------
+    connection : Connection
+        Connection to device in bootloader mode.
+    address : int
+        Start address of the memory to checksum.
+    size : int
+        Number of bytes to checksum.
 
-def _get_remote_checksum(connection: Connection, address: int, length: int) -> int:
+    Returns
+    -------
+    int
+        16-bit checksum, comparable to `get_local_checksum` of the same data.
+    """
     checksum_response = _exchange(
         connection,
         Command(
             command=CommandCode.CALC_CHECKSUM,
-            data_length=length,
+            data_length=size,
             address=address,
         ),
     )
@@ -294,14 +363,25 @@ def _get_remote_checksum(connection: Connection, address: int, length: int) -> i
     return checksum_response.checksum
 
 
-def _get_local_checksum(data: bytes) -> int:
-    chksum = 0
-    extended_address_width = 4
+def get_local_checksum(data: bytes) -> int:
+    """Calculate checksum of data in the same way as the bootloader.
 
-    for batch in batched(data, extended_address_width):
-        chksum += batch[0] + (batch[1] << 8) + batch[2]
+    Parameters
+    ----------
+    data : bytes
+        Firmware data, four bytes per instruction.
 
-    return chksum & 0xFFFF
+    Returns
+    -------
+    int
+        16-bit checksum, comparable to `get_remote_checksum` of the same data.
+    """
+    # Each 24-bit instruction is stored as four bytes, the last of which is a phantom
+    # byte. The bootloader sums the two low bytes of each instruction as a little-endian
+    # 16-bit word, plus the high byte. Let struct and slicing do the work in C rather
+    # than walking the data four bytes at a time.
+    low_words: tuple[int, ...] = struct.unpack_from(f"<{len(data) // 2}H", data)[::2]
+    return (sum(low_words) + sum(data[2::4])) & 0xFFFF
 
 
 def reset(connection: Connection) -> None:
@@ -358,53 +438,50 @@ def _get_response(connection: Connection, in_response_to: Command) -> ResponseBa
     packet : ResponseBase
         An instance of a ResponseBase packet or a subclass thereof.
     """
-    # Can't read the whole response in one go. Its length depends on whether it's an
-    # error or not. Start by reading the command echo to determine the response
-    # type.
-    response = ResponseBase.unpack(connection.read(ResponseBase.size))
-    _logger.debug(f"RX: {_format_debug_bytes(bytes(response))}")
+    response_type = _RESPONSE_TYPES[in_response_to.command]
+    # Formatting received bytes is comparatively slow; skip it unless it is emitted.
+    debug = _logger.isEnabledFor(logging.DEBUG)
+    # Every response starts with the command echo. Check the echoed command code on
+    # its own first, so that a reply to some other command is rejected at once rather
+    # than after waiting for bytes which may never arrive.
+    code = connection.read(1)
+
+    if code and code[0] != in_response_to.command:
+        if debug:
+            _logger.debug(f"RX: {_format_debug_bytes(code)}")
 
-    if response.command != in_response_to.command:
         msg = "Command code mismatch"
         raise BootloaderError(msg)
 
-    response_type_map: dict[CommandCode, type[ResponseBase]] = {
-        CommandCode.READ_VERSION: Version,
-        CommandCode.READ_FLASH: Response,
-        CommandCode.WRITE_FLASH: Response,
-        CommandCode.ERASE_FLASH: Response,
-        CommandCode.CALC_CHECKSUM: Checksum,
-        CommandCode.RESET_DEVICE: Response,
-        CommandCode.SELF_VERIFY: Response,
-        CommandCode.GET_MEMORY_ADDRESS_RANGE: MemoryRange,
-    }
-    response_type = response_type_map[CommandCode(response.command)]
-
-    # READ_VERSION has no 'success' flag.
+    # Can't read the whole response in one go. Its length depends on whether it's an
+    # error or not. However, except for READ_VERSION which is fixed-size, the echo is
+    # followed by the 'success' flag. Read the rest of both in a single call and only
+    # go back to the port for the remainder if the command succeeded. On timeout,
+    # unpacking the short response raises struct.error.
+    head_size = Version.size if response_type is Version else Response.size
+    head = code + connection.read(head_size - 1) if code else code
+    echo, tail = head[: ResponseBase.size], head[ResponseBase.size :]
+
+    if debug:
+        _logger.debug(f"RX: {_format_debug_bytes(echo)}")
+
+        if tail:
+            _logger.debug(f"RX: {_format_debug_bytes(tail, echo)}")
+
     if response_type is Version:
-        remainder = connection.read(response_type.size - response.size)
-        _logger.debug(f"RX: {_format_debug_bytes(remainder, bytes(response))}")
-        return response_type.unpack(response.pack() + remainder)
+        return response_type.unpack(head)
 
-    success = connection.read(1)
-    _logger.debug(f"RX: {_format_debug_bytes(success, bytes(response))}")
+    success = Response.unpack(head).success
 
-    if success[0] != ResponseCode.SUCCESS:
-        bootloader_exceptions: dict[ResponseCode, type[BootloaderError]] = {
-            ResponseCode.UNSUPPORTED_COMMAND: UnsupportedCommand,
-            ResponseCode.BAD_ADDRESS: BadAddress,
-            ResponseCode.BAD_LENGTH: BadLength,
-            ResponseCode.VERIFY_FAIL: VerifyFail,
-        }
-        raise bootloader_exceptions[ResponseCode(success[0])]
+    if success != ResponseCode.SUCCESS:
+        raise _BOOTLOADER_EXCEPTIONS[ResponseCode(success)]
 
-    response = Response.unpack(response.pack() + success)
-    remainder = connection.read(response_type.size - response.size)
+    remainder = connection.read(response_type.size - Response.size)
 
-    if remainder:
-        _logger.debug(f"RX: {_format_debug_bytes(remainder, bytes(response))}")
+    if remainder and debug:
+        _logger.debug(f"RX: {_format_debug_bytes(remainder, head)}")
 
-    return response_type.unpack(response.pack() + remainder)
+    return response_type.unpack(head + remainder)
 
 
 def _exchange(
@@ -412,13 +489,24 @@ def _exchange(
     command: Command,
     data: bytes = b"",
 ) -> ResponseBase:
-    msg = f"TX: {_format_debug_bytes(command.pack())}"
-    msg += f" plus {len(data)} data bytes" if data else ""
-    _logger.debug(msg)
-    connection.write(command.pack() + data)
+    _send(connection, command, data)
     return _get_response(connection, command)
 
 
+def _send(connection: Connection, command: Command, data: bytes = b"") -> None:
+    header = command.pack()
+
+    # Skip formatting the debug message on the hot path unless it will be emitted.
+    if _logger.isEnabledFor(logging.DEBUG):
+        msg = f"TX: {_format_debug_bytes(header)}"
+        msg += f" plus {len(data)} data bytes" if data else ""
+        _logger.debug(msg)
+
+    # Serial.write converts anything but bytes to bytes, so a preallocated bytearray or
+    # memoryview would be copied anyway. A single concatenation is the cheapest option.
+    connection.write(header + data)
+
+
 def _format_debug_bytes(debug_bytes: bytes, pad: bytes = b"") -> str:
     padding = " " * len(pad) * 3
-    return f"{padding}{' '.join(f'{b:02X}' for b in debug_bytes)}"
+    return f"{padding}{debug_bytes.hex(' ').upper()}"
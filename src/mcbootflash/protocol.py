@@ -85,6 +85,26 @@ class Command(Packet):
     Layout is identical to Packet.
     """
 
+    def __bytes__(self) -> bytes:
+        """Pack all fields with a single precompiled Struct.
+
+        A command is packed for every chunk, and the field-by-field packing done by
+        DataStructClass is comparatively slow.
+
+        Returns
+        -------
+        bytes
+        """
+        return _PACKET_STRUCT.pack(
+            self.command,
+            self.data_length,
+            self.unlock_sequence,
+            self.address,
+        )
+
+
+_PACKET_STRUCT = Struct("=" + "".join(fmt.lstrip("=") for fmt in Packet.format))
+
 
 @dataclass
 class ResponseBase(Packet):
@@ -1,26 +1,48 @@
 """Utility functions."""
 
-from collections.abc import Iterator
-from typing import TextIO
+from __future__ import annotations
+
+import copy
+from typing import TYPE_CHECKING, TextIO
 
 import bincopy  # type: ignore[import-untyped]
 
-from mcbootflash.flash import get_boot_attrs, read_flash
+from mcbootflash.error import BadAddress
+from mcbootflash.flash import (
+    get_boot_attrs,
+    get_local_checksum,
+    get_remote_checksum,
+    read_flash,
+)
 from mcbootflash.protocol import BootAttrs, Chunk, Command, Connection
 
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
 
 def chunked(
-    hexfile: str,
+    hexfile: str | bincopy.BinFile,
     boot_attrs: BootAttrs,
+    pages: Iterable[tuple[int, int]] | None = None,
+    chunk_size: int | None = None,
 ) -> tuple[int, Iterator[Chunk]]:
     """Split a HEX file into chunks.
 
     Parameters
     ----------
-    hexfile : str
-        Path of a HEX file containing application firmware.
+    hexfile : str | bincopy.BinFile
+        Path of a HEX file containing application firmware, or its contents as
+        loaded by `bincopy.BinFile.add_microchip_hex_file`.
     boot_attrs : BootAttrs
         The bootloader's attributes, as read by `get_boot_attrs`.
+    pages : Iterable[tuple[int, int]], optional
+        Only include data within these address ranges, for example the flash pages
+        returned by `stale_pages`. By default, all data within the program memory
+        range is included.
+    chunk_size : int, optional
+        Maximum number of data bytes per chunk. Rounded down to a multiple of the
+        bootloader's write size, and clamped between the write size and the largest
+        payload which fits in a packet. By default, chunks are as large as possible.
 
     Returns
     -------
@@ -34,24 +56,117 @@ def chunked(
     ------
     bincopy.Error
         If HEX file contains no data in program memory range.
+    ValueError
+        If a page in `pages` is empty or not within the program memory range.
     """
-    hexdata = bincopy.BinFile()
-    hexdata.add_microchip_hex_file(hexfile)
-    hexdata.crop(*boot_attrs.memory_range)
-    chunk_size = boot_attrs.max_packet_length - Command.size
-    chunk_size -= chunk_size % boot_attrs.write_size
-    chunk_size //= hexdata.word_size_bytes
-    total_bytes = len(hexdata) * hexdata.word_size_bytes
+    hexdata = _load_hex(hexfile, boot_attrs)
 
-    if total_bytes == 0:
+    if len(hexdata) == 0:
         msg = "HEX file contains no data within program memory range"
         raise bincopy.Error(msg)
 
+    if pages is not None:
+        program_start, program_end = boot_attrs.memory_range
+        low = program_start
+
+        for start, end in sorted(pages):
+            if not program_start <= start < end <= program_end:
+                msg = (
+                    f"Page {start:#08x}:{end:#08x} is not within program memory range "
+                    f"{program_start:#08x}:{program_end:#08x}"
+                )
+                raise ValueError(msg)
+
+            if low < start:
+                hexdata.exclude(low, start)
+
+            low = max(low, end)
+
+        hexdata.exclude(low, program_end)
+
+    max_chunk_size = boot_attrs.max_packet_length - Command.size
+    chunk_size = min(chunk_size or max_chunk_size, max_chunk_size)
+    chunk_size -= chunk_size % boot_attrs.write_size
+    chunk_size = max(chunk_size, boot_attrs.write_size)
+    chunk_size //= hexdata.word_size_bytes
+    total_bytes = len(hexdata) * hexdata.word_size_bytes
     total_bytes += (boot_attrs.write_size - total_bytes) % boot_attrs.write_size
     align = boot_attrs.write_size // hexdata.word_size_bytes
     return total_bytes, hexdata.segments.chunks(chunk_size, align, b"\xff\xff")
 
 
+def stale_pages(
+    connection: Connection,
+    hexfile: str | bincopy.BinFile,
+    boot_attrs: BootAttrs,
+) -> list[tuple[int, int]]:
+    """Find flash pages whose contents differ from a HEX file.
+
+    Each flash page in the program memory range is checksummed by the bootloader, and
+    the result is compared to the checksum of the same address range in the HEX file.
+    Addresses which are not present in the HEX file are expected to be erased.
+
+    Note
+    ----
+    The bootloader's checksum is a 16-bit sum, so two pages which differ only by
+    reordered instructions have the same checksum. Such pages are not detected as stale.
+
+    Parameters
+    ----------
+    connection : Connection
+        Connection to device in bootloader mode.
+    hexfile : str | bincopy.BinFile
+        Path of a HEX file containing application firmware, or its contents as
+        loaded by `bincopy.BinFile.add_microchip_hex_file`.
+    boot_attrs : BootAttrs
+        The bootloader's attributes, as read by `get_boot_attrs`.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        Half-open address ranges of the flash pages which must be erased and rewritten
+        for the device to contain the HEX file.
+    """
+    hexdata = _load_hex(hexfile, boot_attrs)
+    page_size = boot_attrs.erase_size
+    low, high = boot_attrs.memory_range
+    # Every whole page, including the one ending at the top of the memory range.
+    page_starts = range(low, high - page_size + 1, page_size)
+    pages = [(start, start + page_size) for start in page_starts]
+    return [page for page in pages if not _page_matches(connection, hexdata, page)]
+
+
+def _page_matches(
+    connection: Connection,
+    hexdata: bincopy.BinFile,
+    page: tuple[int, int],
+) -> bool:
+    expected = hexdata.as_binary(*page)
+    size = (page[1] - page[0]) * hexdata.word_size_bytes
+    expected += b"\xff" * (size - len(expected))
+
+    try:
+        remote_checksum = get_remote_checksum(connection, page[0], size)
+    except BadAddress:
+        # See https://github.com/bessman/mcbootflash/issues/54. Without a checksum the
+        # page must be assumed to differ.
+        return False
+
+    return remote_checksum == get_local_checksum(expected)
+
+
+def _load_hex(hexfile: str | bincopy.BinFile, boot_attrs: BootAttrs) -> bincopy.BinFile:
+    if isinstance(hexfile, bincopy.BinFile):
+        # Let the caller reuse an already parsed file; don't crop it under them.
+        hexdata = copy.deepcopy(hexfile)
+    else:
+        hexdata = bincopy.BinFile()
+        hexdata.add_microchip_hex_file(hexfile)
+
+    hexdata.crop(*boot_attrs.memory_range)
+    return hexdata
+
+
 def readback(connection: Connection, outfile: TextIO) -> None:
     """Readback programmed application from flash memory.
 
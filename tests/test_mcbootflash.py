@@ -6,7 +6,7 @@ from pathlib import Path
 
 import bincopy
 import pytest
-from serial import Serial
+from serial import Serial, SerialTimeoutException
 
 import mcbootflash as bf
 import mcbootflash.__main__ as main
@@ -22,6 +22,20 @@ def connection():
     return Serial(port=PORTNAME, baudrate=BAUDRATE, timeout=1)
 
 
+@pytest.fixture(autouse=True)
+def _replayed_low_latency_mode(monkeypatch):
+    # A replayed port has no file descriptor to set the low-latency flag on. Fail the
+    # way pyserial does for a driver which doesn't support the flag.
+    if Path(PORTNAME).exists():
+        return
+
+    def unsupported(self, low_latency_settings):  # noqa: ARG001
+        msg = "Failed to update ASYNC_LOW_LATENCY flag"
+        raise ValueError(msg)
+
+    monkeypatch.setattr(Serial, "set_low_latency_mode", unsupported)
+
+
 def test_wrong_packet():
     resp = mcbootflash.protocol.Checksum(mcbootflash.protocol.CommandCode.CALC_CHECKSUM)
     with pytest.raises(struct.error) as excinfo:
@@ -42,7 +56,12 @@ def test_cli(reserial, caplog, debug, quiet):
             baudrate=BAUDRATE,
             timeout=1,
             checksum=True,
+            chunk_size=None,
+            erase_batch=1,
+            pipeline=False,
             reset=False,
+            skip_unchanged=False,
+            no_verify=False,
             debug=debug,
             quiet=quiet,
         ),
@@ -50,6 +69,135 @@ def test_cli(reserial, caplog, debug, quiet):
     assert "Self verify OK" in caplog.messages[-1]
 
 
+def test_cli_pipeline(reserial, caplog):
+    # Replays the test_cli recording, which only shows that the byte streams are
+    # unchanged. Whether a device accepts the early checksum command is untested.
+    caplog.set_level(logging.INFO)
+    main.main(
+        argparse.Namespace(
+            hexfile="tests/testcases/flash/test.hex",
+            port=PORTNAME,
+            baudrate=BAUDRATE,
+            timeout=1,
+            checksum=True,
+            chunk_size=None,
+            erase_batch=1,
+            pipeline=True,
+            reset=False,
+            skip_unchanged=False,
+            no_verify=False,
+            debug=False,
+            quiet=False,
+        ),
+    )
+    assert "Self verify OK" in caplog.messages[-1]
+
+
+def test_cli_no_verify(reserial, caplog):
+    caplog.set_level(logging.INFO)
+    # The recording ends with the last write, so sending SELF_VERIFY would fail replay.
+    return_code = main.main(
+        argparse.Namespace(
+            hexfile="tests/testcases/flash/test.hex",
+            port=PORTNAME,
+            baudrate=BAUDRATE,
+            timeout=1,
+            checksum=True,
+            chunk_size=None,
+            erase_batch=1,
+            pipeline=False,
+            reset=False,
+            skip_unchanged=False,
+            no_verify=True,
+            debug=False,
+            quiet=False,
+        ),
+    )
+    assert return_code == 0
+    assert "Self verify OK" not in caplog.text
+
+
+def test_cli_no_verify_without_checksum(caplog):
+    caplog.set_level(logging.INFO)
+    return_code = main.main(
+        argparse.Namespace(
+            hexfile="tests/testcases/flash/test.hex",
+            port=PORTNAME,
+            baudrate=BAUDRATE,
+            timeout=1,
+            checksum=False,
+            chunk_size=None,
+            erase_batch=1,
+            pipeline=False,
+            reset=False,
+            skip_unchanged=False,
+            no_verify=True,
+            debug=False,
+            quiet=False,
+        ),
+    )
+    assert return_code == 1
+    assert "--no-verify requires --checksum" in caplog.messages[-1]
+
+
+def test_cli_skip_unchanged(reserial, caplog):
+    if Path(PORTNAME).exists():
+        # Skip unchanged uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping skip unchanged test"
+        pytest.skip(msg)
+
+    caplog.set_level(logging.INFO)
+    # Only the first page differs from the HEX file.
+    return_code = main.main(
+        argparse.Namespace(
+            hexfile="tests/testcases/flash/test.hex",
+            port=PORTNAME,
+            baudrate=BAUDRATE,
+            timeout=1,
+            checksum=True,
+            chunk_size=None,
+            erase_batch=1,
+            pipeline=False,
+            reset=False,
+            skip_unchanged=True,
+            no_verify=False,
+            debug=False,
+            quiet=True,
+        ),
+    )
+    assert return_code == 0
+    assert "Found 1 changed flash pages" in caplog.messages
+    assert "Self verify OK" in caplog.messages[-1]
+
+
+def test_cli_skip_unchanged_unsupported(reserial, caplog):
+    if Path(PORTNAME).exists():
+        # Skip unchanged uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping skip unchanged test"
+        pytest.skip(msg)
+
+    caplog.set_level(logging.INFO)
+    return_code = main.main(
+        argparse.Namespace(
+            hexfile="tests/testcases/flash/test.hex",
+            port=PORTNAME,
+            baudrate=BAUDRATE,
+            timeout=1,
+            checksum=True,
+            chunk_size=None,
+            erase_batch=1,
+            pipeline=False,
+            reset=False,
+            skip_unchanged=True,
+            no_verify=False,
+            debug=False,
+            quiet=True,
+        ),
+    )
+    assert return_code == 1
+    assert "requires bootloader checksum support" in caplog.messages[-1]
+
+
 def test_cli_error(caplog):
     if Path(PORTNAME).exists():
         msg = f"{PORTNAME} exists: skipping device not connected test"
@@ -63,7 +211,12 @@ def test_cli_error(caplog):
             baudrate=BAUDRATE,
             timeout=10,
             checksum=True,
+            chunk_size=None,
+            erase_batch=1,
+            pipeline=False,
             reset=False,
+            skip_unchanged=False,
+            no_verify=False,
             debug=True,
             quiet=False,
         ),
@@ -71,6 +224,45 @@ def test_cli_error(caplog):
     assert caplog.records[-1].levelno == logging.ERROR
 
 
+def test_cli_write_timeout(reserial, caplog, monkeypatch):
+    if Path(PORTNAME).exists():
+        msg = f"{PORTNAME} exists: skipping synthetic write timeout test"
+        pytest.skip(msg)
+
+    # Synthetic data: the device never accepts the first command.
+    def stalled(self, data):  # noqa: ARG001
+        msg = "Write timeout"
+        raise SerialTimeoutException(msg)
+
+    monkeypatch.setattr(Serial, "write", stalled)
+    caplog.set_level(logging.INFO)
+    return_code = main.main(
+        argparse.Namespace(
+            hexfile="tests/testcases/flash/test.hex",
+            port=PORTNAME,
+            baudrate=BAUDRATE,
+            timeout=1,
+            checksum=True,
+            chunk_size=None,
+            erase_batch=1,
+            pipeline=False,
+            reset=False,
+            skip_unchanged=False,
+            no_verify=False,
+            debug=False,
+            quiet=False,
+        ),
+    )
+    assert return_code == 1
+    assert caplog.messages[-1] == "Error: Timeout while writing to serial port"
+
+
+def test_low_latency_mode_unsupported(reserial, caplog, connection):
+    caplog.set_level(logging.DEBUG)
+    main.set_low_latency_mode(connection)
+    assert "Low-latency mode not supported" in caplog.text
+
+
 def test_get_parser():
     parser = main.get_parser()
     assert parser.description == (
@@ -80,10 +272,43 @@ def test_get_parser():
     )
 
 
+@pytest.mark.parametrize("value", ["0", "-1", "two"])
+def test_get_parser_erase_batch_invalid(value):
+    parser = main.get_parser()
+    with pytest.raises(SystemExit):
+        parser.parse_args(
+            ["test.hex", "-p", PORTNAME, "-b", "460800", "--erase-batch", value]
+        )
+
+
+def test_get_parser_chunk_size_invalid():
+    parser = main.get_parser()
+    with pytest.raises(SystemExit):
+        parser.parse_args(
+            ["test.hex", "-p", PORTNAME, "-b", "460800", "--chunk-size", "0"],
+        )
+
+
+def test_parse_hex_chunk_size_misaligned():
+    bootattrs = bf.BootAttrs(258, 256, 13398, 2048, 8, (6144, 174080))
+    with pytest.raises(main.HandledException) as excinfo:
+        main.parse_hex("tests/testcases/flash/test.hex", bootattrs, chunk_size=100)
+    assert "multiple of the bootloader's write size" in str(excinfo.value)
+
+
 def test_datasize_large():
     assert main.get_datasize(2**20) == "1.0 MiB"
 
 
+def test_datasize_small():
+    assert main.get_datasize(999) == "999 B"
+    assert main.get_datasize(1000) == "1.0 KiB"
+
+
+def test_datasize_huge():
+    assert main.get_datasize(2**30) == "1024.0 MiB"
+
+
 def test_progressbar(capsys):
     import logging
 
@@ -97,6 +322,16 @@ def test_progressbar(capsys):
     assert capsys.readouterr().out == expected
 
 
+def test_progressbar_throttled(capsys, monkeypatch):
+    info_handler = logging.Handler(level=logging.INFO)
+    monkeypatch.setattr(main.logger, "handlers", [info_handler])
+    drawn_at = main.print_progress(150, 200, 5 + main.PROGRESS_INTERVAL / 2, 5)
+    assert capsys.readouterr().out == ""
+    assert drawn_at == 5
+    main.print_progress(200, 200, 5 + main.PROGRESS_INTERVAL / 2, drawn_at)
+    assert capsys.readouterr().out.startswith("100%")
+
+
 def test_get_bootattrs(reserial, connection):
     test_device_boot_attrs = bf.BootAttrs(
         version=258,
@@ -117,6 +352,112 @@ def test_erase(reserial, caplog, connection):
     assert "Erasing addresses" in caplog.messages[-4]
 
 
+def test_erase_workaround(reserial, caplog, connection):
+    if Path(PORTNAME).exists():
+        # Erase workaround uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping erase workaround test"
+        pytest.skip(msg)
+
+    caplog.set_level(logging.DEBUG)
+    main.erase(connection, (6144, 12288), 2048)
+    assert "Attempting workaround" in caplog.text
+    assert "Erasing addresses 0x001800:0x003000" in caplog.messages[-4]
+    assert connection.timeout == 1
+
+
+def test_erase_workaround_first_page(reserial, caplog, connection):
+    if Path(PORTNAME).exists():
+        # Erase workaround uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping erase workaround test"
+        pytest.skip(msg)
+
+    caplog.set_level(logging.DEBUG)
+    # No page has been erased yet, so there is no erase time to size the timeout by.
+    main.erase(connection, (6144, 12288), 2048)
+    assert "Using timeout 10 s for workaround" in caplog.messages
+    assert connection.timeout == 1
+
+
+def test_erase_workaround_fail(reserial, connection):
+    if Path(PORTNAME).exists():
+        # Erase workaround uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping erase workaround test"
+        pytest.skip(msg)
+
+    with pytest.raises(bf.BadAddress):
+        main.erase(connection, (6144, 12288), 2048)
+    assert connection.timeout == 1
+
+
+def test_erase_batch(reserial, caplog, connection):
+    if Path(PORTNAME).exists():
+        # Erase batch uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping erase batch test"
+        pytest.skip(msg)
+
+    caplog.set_level(logging.DEBUG)
+    pages = [(6144, 8192), (8192, 10240), (10240, 12288), (12288, 14336)]
+    # Not adjacent to the previous page, so erased on its own.
+    pages.append((16384, 18432))
+    main.erase(connection, (6144, 18432), 2048, pages, batch_size=2)
+    assert "Erasing addresses 0x001800:0x002800" in caplog.text
+    assert "Erasing addresses 0x002800:0x003800" in caplog.text
+    assert "Erasing addresses 0x004000:0x004800" in caplog.text
+
+
+def test_erase_pages_bad_address(reserial, connection):
+    if Path(PORTNAME).exists():
+        # Erase pages uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping erase pages test"
+        pytest.skip(msg)
+
+    # The workaround would erase the first page, which is not going to be rewritten.
+    with pytest.raises(main.HandledException) as excinfo:
+        main.erase(connection, (6144, 12288), 2048, [(8192, 10240)])
+    assert "cannot erase individual pages" in str(excinfo.value)
+
+
+def test_erase_pages_workaround(reserial, caplog, connection):
+    if Path(PORTNAME).exists():
+        # Erase pages uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping erase pages test"
+        pytest.skip(msg)
+
+    caplog.set_level(logging.DEBUG)
+    # Every page touched by the workaround is going to be rewritten anyway.
+    main.erase(connection, (6144, 12288), 2048, [(8192, 10240), (10240, 12288)])
+    assert "Erasing addresses 0x002000:0x003000" in caplog.text
+
+
+def test_batch_pages():
+    pages = [(0, 2), (2, 4), (4, 6), (8, 10)]
+    assert main.batch_pages(pages, 1) == pages
+    assert main.batch_pages(pages, 2) == [(0, 4), (4, 6), (8, 10)]
+    assert main.batch_pages(pages, 8) == [(0, 6), (8, 10)]
+
+
+def test_is_blank():
+    assert main.is_blank(b"\xff\xff\xff\x00" * 4)
+    assert not main.is_blank(b"\xff\xff\xff\x00" * 3 + b"\xff\xfe\xff\x00")
+
+
+def test_flash_skip_blank(reserial, caplog, connection):
+    if Path(PORTNAME).exists():
+        # Flash skip blank uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping flash skip blank test"
+        pytest.skip(msg)
+
+    caplog.set_level(logging.DEBUG)
+    bootattrs = bf.BootAttrs(258, 256, 13398, 2048, 8, (6144, 174080))
+    hexdata = bincopy.BinFile(word_size_bits=16)
+    hexdata.add_binary(b"\xff" * 16, address=0x2000)
+    hexdata.add_binary(bytes([1, 2, 3, 0]) * 4, address=0x2100)
+    total_bytes, chunks = bf.chunked(hexdata, bootattrs)
+    # The recording holds WRITE_FLASH and CALC_CHECKSUM for the second chunk only.
+    main.flash(connection, chunks, total_bytes, verify_checksum=True)
+    assert "Skipping blank chunk at 0x002000" in caplog.messages
+
+
 def test_erase_misaligned():
     with pytest.raises(ValueError) as excinfo:
         bf.erase_flash(Serial(), (0, 1), 2)
@@ -155,12 +496,140 @@ def test_no_data():
     assert "no data" in str(excinfo.value)
 
 
+def test_chunked_pages():
+    bootattrs = bf.BootAttrs(
+        version=258,
+        max_packet_length=256,
+        device_id=13398,
+        erase_size=2048,
+        write_size=8,
+        memory_range=(6144, 174080),
+    )
+    hexfile = "tests/testcases/flash/test.hex"
+    first_page = (6144, 6144 + bootattrs.erase_size)
+    _, all_chunks = bf.chunked(hexfile, bootattrs)
+    _, page_chunks = bf.chunked(hexfile, bootattrs, [])
+    assert list(page_chunks) == []
+    _, page_chunks = bf.chunked(hexfile, bootattrs, [first_page])
+    page_chunks = list(page_chunks)
+    assert page_chunks == [c for c in all_chunks if c.address < first_page[1]]
+    # A range contained in another one must not exclude the rest of the outer range.
+    _, nested_chunks = bf.chunked(hexfile, bootattrs, [first_page, (6400, 6600)])
+    assert list(nested_chunks) == page_chunks
+
+
+def test_chunked_chunk_size():
+    bootattrs = bf.BootAttrs(
+        version=258,
+        max_packet_length=256,
+        device_id=13398,
+        erase_size=2048,
+        write_size=8,
+        memory_range=(6144, 174080),
+    )
+    hexfile = "tests/testcases/flash/test.hex"
+    _, chunks = bf.chunked(hexfile, bootattrs, chunk_size=100)
+    assert max(len(chunk.data) for chunk in chunks) == 96
+    _, chunks = bf.chunked(hexfile, bootattrs, chunk_size=1)
+    assert max(len(chunk.data) for chunk in chunks) == bootattrs.write_size
+    _, chunks = bf.chunked(hexfile, bootattrs, chunk_size=10000)
+    assert max(len(chunk.data) for chunk in chunks) == 240
+
+
+def test_chunked_binfile():
+    bootattrs = bf.BootAttrs(
+        version=258,
+        max_packet_length=256,
+        device_id=13398,
+        erase_size=2048,
+        write_size=8,
+        memory_range=(6144, 174080),
+    )
+    hexfile = "tests/testcases/flash/test.hex"
+    hexdata = bincopy.BinFile()
+    hexdata.add_microchip_hex_file(hexfile)
+    size = len(hexdata)
+    _, expected = bf.chunked(hexfile, bootattrs)
+    _, chunks = bf.chunked(hexdata, bootattrs, [(6144, 8192)])
+    assert list(chunks) == [c for c in expected if c.address < 8192]
+    assert len(hexdata) == size
+
+
+def test_chunked_pages_gap():
+    bootattrs = bf.BootAttrs(258, 256, 13398, 2048, 8, (6144, 174080))
+    hexdata = bincopy.BinFile()
+    hexdata.add_microchip_hex_file("tests/testcases/flash/test.hex")
+    hexdata.add_binary(bytes([1, 2, 3, 0]) * 4, address=0x2100)
+    hexdata.add_binary(bytes([1, 2, 3, 0]) * 4, address=0x3100)
+    # Data before, between and after the selected pages is excluded.
+    _, chunks = bf.chunked(hexdata, bootattrs, [(0x2000, 0x2800)])
+    assert [chunk.address for chunk in chunks] == [0x2100]
+
+
+def test_chunked_pages_out_of_range():
+    bootattrs = bf.BootAttrs(
+        version=258,
+        max_packet_length=256,
+        device_id=13398,
+        erase_size=2048,
+        write_size=8,
+        memory_range=(6144, 174080),
+    )
+    hexfile = "tests/testcases/flash/test.hex"
+    with pytest.raises(ValueError, match="not within program memory range"):
+        bf.chunked(hexfile, bootattrs, [(4096, 6144)])
+    with pytest.raises(ValueError, match="not within program memory range"):
+        bf.chunked(hexfile, bootattrs, [(8192, 8192)])
+
+
+def test_stale_pages(reserial, connection):
+    if Path(PORTNAME).exists():
+        # Stale pages uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping stale pages test"
+        pytest.skip(msg)
+
+    bootattrs = bf.BootAttrs(258, 256, 13398, 2048, 8, (6144, 12288))
+    # The second page differs from the HEX file, the first and the last match it.
+    pages = bf.stale_pages(connection, "tests/testcases/flash/test.hex", bootattrs)
+    assert pages == [(8192, 10240)]
+
+
+def test_stale_pages_bad_address(reserial, connection):
+    if Path(PORTNAME).exists():
+        # Stale pages uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping stale pages test"
+        pytest.skip(msg)
+
+    bootattrs = bf.BootAttrs(258, 256, 13398, 2048, 8, (6144, 12288))
+    # The bootloader cannot checksum the first page, so it must be assumed to differ.
+    pages = bf.stale_pages(connection, "tests/testcases/flash/test.hex", bootattrs)
+    assert pages == [(6144, 8192)]
+
+
+def test_stale_pages_last_page(reserial, connection):
+    if Path(PORTNAME).exists():
+        # Stale pages uses synthetic data.
+        msg = f"{PORTNAME} exists: skipping stale pages test"
+        pytest.skip(msg)
+
+    bootattrs = bf.BootAttrs(258, 256, 13398, 2048, 8, (6144, 174080))
+    hexdata = bincopy.BinFile()
+    hexdata.add_microchip_hex_file("tests/testcases/flash/test.hex")
+    # The device already contains test.hex, but not this data in its last page.
+    hexdata.add_binary(bytes([1, 2, 3, 0]) * 4, address=0x2A100)
+    pages = bf.stale_pages(connection, hexdata, bootattrs)
+    assert pages == [(0x2A000, 0x2A800)]
+    _, chunks = bf.chunked(hexdata, bootattrs, pages)
+    assert [chunk.address for chunk in chunks] == [0x2A100]
+
+
 def test_unexpected_response(reserial, connection):
     if Path(PORTNAME).exists():
         # Unexpected response uses synthetic data.
         msg = f"{PORTNAME} exists: skipping unexpected response test"
         pytest.skip(msg)
 
+    # A single byte echoing the wrong command is rejected without waiting for more.
     with pytest.raises(bf.BootloaderError) as excinfo:
         bf.reset(connection)
     assert "Command code mismatch" in str(excinfo.value)
@@ -187,6 +656,16 @@ def test_format_debug_bytes():
     assert formatted_tx + "\n" + formatted_rx == expected
 
 
+def test_local_checksum():
+    data = bytes(range(256)) * 4
+    expected = 0
+
+    for i in range(0, len(data), 4):
+        expected += data[i] + (data[i + 1] << 8) + data[i + 2]
+
+    assert bf.get_local_checksum(data) == expected & 0xFFFF
+
+
 def test_checksum_bad_address_warning(reserial, caplog, connection):
     boot_attrs = bf.get_boot_attrs(connection)
     payload_size = 240
@@ -204,3 +683,16 @@ def test_reset(reserial, caplog, connection):
     caplog.set_level(logging.DEBUG)
     bf.reset(connection)
     assert "Device reset" in caplog.messages[-1]
+
+
+def test_command_pack():
+    command = mcbootflash.protocol.Command(
+        command=mcbootflash.protocol.CommandCode.WRITE_FLASH,
+        data_length=0x1234,
+        unlock_sequence=0x00AA0055,
+        address=0x89ABCDEF,
+    )
+    # Compare with the generic, field-by-field DataStructClass packing.
+    expected = mcbootflash.protocol.Packet.__bytes__(command)
+    assert command.pack() == expected
+    assert mcbootflash.protocol.Command.unpack(expected) == command